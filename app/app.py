@@ -1,12 +1,63 @@
 """The application"""
-from flask import Flask, render_template, request
+import copy
+import json
+import logging
+import os
+import time
+
+from cache import ResultCache
+from flask import Flask, Response, render_template, request
 from flight_info import FlightInfo
+from heatmap import traffic_heatmap
+from jobs import JobManager
+from lod import MAX_DIRECT_ROUTES, aggregate_routes, count_routes
+from metrics import MetricsRegistry, QueryTimer
 from request import Request
+from routes import RouteTable, load_airports
+from store import FlightStore
 
 FILENAME = "./data/testing_data.csv"
 
+# Set to a store written by store.py to load only the partitions each
+# request needs instead of keeping FILENAME in memory
+STORE_DIRECTORY = None
+
+# Set to False to stop serving the Prometheus metrics endpoint
+ENABLE_METRICS = True
+
+# Bytes of response bodies kept for repeated queries; set the environment
+# variable to 0 to turn the cache off, e.g. for load_test.py
+RESULT_CACHE_BYTES = int(
+    os.environ.get("FLIGHT_TRACKER_RESULT_CACHE_BYTES", 64 * 1024 * 1024)
+)
+
+# Background query jobs: worker threads, most queued or running jobs, and
+# the time (seconds) and memory (bytes) each job may use
+JOB_WORKERS = 2
+JOB_MAX_PENDING = 8
+JOB_TIME_BUDGET = 120
+JOB_MEMORY_BUDGET = 512 * 1024 * 1024
+
+# Layover searches can run for minutes, so the pages that answer right away
+# refuse them and the frontend runs them through /jobs instead
+LAYOVER_ERROR = {"error": "layover searches run in the background, POST /jobs"}
+
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
-flights = FlightInfo(FILENAME)
+metrics = MetricsRegistry()
+if STORE_DIRECTORY is None:
+    store = None
+    flights = FlightInfo(FILENAME, metrics)
+else:
+    store = FlightStore(STORE_DIRECTORY)
+    flights = None
+airports = load_airports()
+routes = RouteTable(
+    flights.full_data if store is None else store.airport_pairs(), airports
+)
+results = ResultCache(RESULT_CACHE_BYTES)
+jobs = JobManager(JOB_WORKERS, JOB_MAX_PENDING, JOB_TIME_BUDGET, JOB_MEMORY_BUDGET)
 
 
 @app.route("/")
@@ -15,37 +66,77 @@ def home():
     return render_template("index.html")
 
 
-@app.route("/form")
-def form():
-    """The form page"""
-    name = request.cookies.get("form")
-
-    req = Request(name)
+def run_filters(req, timer, progress=None):
+    """
+    Run every filter of a request
+    Parameters:
+        req: request object from the frontend
+        timer: QueryTimer the filter stages are recorded in
+        progress: optional progress function passed to the filters that
+            loop over flights
+    Returns: FlightInfo object whose details are the matching flights
+    """
+    if store is None:
+        # a shallow copy shares full_data and the mask cache but gets its own
+        # details, so concurrent queries don't filter each other's rows
+        query = copy.copy(flights)
+        query.details = query.full_data
+    else:
+        with timer.stage("load"):
+            query = FlightInfo(store.load_request(req), metrics)
 
-    flights.details = flights.full_data.copy()
+    with timer.stage("location", query):
+        query.filter_by_location(
+            req.origin_type, req.origin_values, req.dest_type, req.dest_values
+        )
 
-    flights.filter_by_location(
-        req.origin_type, req.origin_values, req.dest_type, req.dest_values
-    )
+    with timer.stage("time", query):
+        query.filter_by_time(req.start_date, req.start_time, req.end_date, req.end_time)
 
-    flights.filter_by_time(req.start_date, req.start_time, req.end_date, req.end_time)
+    with timer.stage("day_of_week", query):
+        query.filter_by_day_of_week(req.day_of_week)
 
-    flights.filter_by_day_of_week(req.day_of_week)
+    with timer.stage("airline", query):
+        query.filter_by_airline(req.airlines)
 
-    flights.filter_by_airline(req.airlines)
+    with timer.stage("cargo", query):
+        query.filter_by_cargo(req.is_cargo, req.is_passenger)
 
-    flights.filter_by_cargo(req.is_cargo, req.is_passenger)
+    with timer.stage("distance", query):
+        query.filter_by_distance(routes, req.min_distance, req.max_distance)
 
-    flights.filter_by_stops(req)
+    with timer.stage("stops", query):
+        query.filter_by_stops(req, progress)
 
     if req.adv_req.filter_added == "true":
-        flights.filter_by_added(req)
+        with timer.stage("added", query):
+            query.filter_by_added(req, progress)
 
     if req.adv_req.filter_removed == "true":
-        flights.filter_by_removed(req)
+        with timer.stage("removed", query):
+            query.filter_by_removed(req, progress)
+
+    return query
+
+
+def needs_job(req):
+    """
+    True if a request searches for layovers and has to run as a background job
+    Parameters:
+        req: request object from the frontend
+    """
+    return int(req.num_layovers) > 0
+
 
+def collect_routes(details):
+    """
+    Collect the distinct routes of the matching flights
+    Parameters:
+        details: pandas dataframe with the matching flights
+    Returns: list of [origin, destination, airline, is_cargo] lists
+    """
     ret_val = set()
-    for _, row in flights.details.iterrows():
+    for _, row in details.iterrows():
         origin_airport = row["ORIGIN_AIRPORT"]
         destination_airport = row["DESTINATION_AIRPORT"]
         airline = row["AIRLINE"]
@@ -56,5 +147,188 @@ def form():
     ret_val_list = []
     for item in ret_val:
         ret_val_list.append([item[0], item[1], item[2], item[3]])
-    print("\nReturn Dataframe:\n", ret_val_list)
-    return f"{ret_val_list}"
+    logger.debug("Return Dataframe: %s", ret_val_list)
+    return ret_val_list
+
+
+def cached_body(key, timer, compute):
+    """
+    Get a response body from the result cache, computing it on a miss
+    Parameters:
+        key: hashable key of the response, e.g. the page and the cookie
+        timer: QueryTimer of the request
+        compute: function returning the body as a string
+    """
+    body = results.get(key)
+    metrics.record_cache("results", body is not None)
+    if body is None:
+        body = compute()
+        results.put(key, body)
+
+    timer.payload_bytes = len(body.encode("utf8"))
+    metrics.record(timer)
+    return body
+
+
+@app.route("/form")
+def form():
+    """The form page"""
+    timer = QueryTimer()
+    name = request.cookies.get("form")
+
+    with timer.stage("parse"):
+        req = Request(name)
+    if needs_job(req):
+        return LAYOVER_ERROR, 400
+
+    def compute():
+        query = run_filters(req, timer)
+
+        with timer.stage("collect"):
+            ret_val_list = routes.attach(collect_routes(query.details))
+
+        with timer.stage("serialize"):
+            return f"{ret_val_list}"
+
+    body = cached_body(("form", name), timer, compute)
+    return body, {"Server-Timing": timer.server_timing()}
+
+
+@app.route("/lod")
+def lod():
+    """
+    The form page for a zoom level: the routes like /form returns them if there
+    are at most MAX_DIRECT_ROUTES, else aggregated into a bounded number of edges
+    """
+    timer = QueryTimer()
+    name = request.cookies.get("form")
+    zoom = request.args.get("zoom", default=0, type=int)
+
+    with timer.stage("parse"):
+        req = Request(name)
+    if needs_job(req):
+        return LAYOVER_ERROR, 400
+
+    def compute():
+        query = run_filters(req, timer)
+
+        with timer.stage("count"):
+            route_count = count_routes(query.details)
+
+        if route_count <= MAX_DIRECT_ROUTES:
+            with timer.stage("collect"):
+                ret_val = {
+                    "zoom": zoom,
+                    "routes": route_count,
+                    "flights": routes.attach(collect_routes(query.details)),
+                }
+        else:
+            with timer.stage("aggregate"):
+                ret_val = aggregate_routes(query.details, airports, zoom)
+
+        with timer.stage("serialize"):
+            return json.dumps(ret_val)
+
+    body = cached_body(("lod", name, zoom), timer, compute)
+    return body, {
+        "Content-Type": "application/json",
+        "Server-Timing": timer.server_timing(),
+    }
+
+
+@app.route("/heatmap")
+def heatmap():
+    """Departures and arrivals of the form query per airport, day of week and hour"""
+    timer = QueryTimer()
+    name = request.cookies.get("form")
+
+    with timer.stage("parse"):
+        req = Request(name)
+    if needs_job(req):
+        return LAYOVER_ERROR, 400
+
+    def compute():
+        query = run_filters(req, timer)
+
+        with timer.stage("bincount"):
+            ret_val = traffic_heatmap(query.details)
+
+        with timer.stage("serialize"):
+            return json.dumps(ret_val)
+
+    body = cached_body(("heatmap", name), timer, compute)
+    return body, {
+        "Content-Type": "application/json",
+        "Server-Timing": timer.server_timing(),
+    }
+
+
+@app.route("/metrics")
+def metrics_page():
+    """The metrics page, in the Prometheus text format"""
+    if not ENABLE_METRICS:
+        return "Metrics are disabled", 404
+    return metrics.prometheus(), {"Content-Type": "text/plain; version=0.0.4"}
+
+
+def run_job(job, req):
+    """
+    Run the filters of a request as a background job
+    Parameters:
+        job: Job the query runs as
+        req: request object from the frontend
+    """
+    timer = QueryTimer(job.check)
+    job.stages = timer.stages
+    query = run_filters(req, timer, job.progress)
+    with timer.stage("collect"):
+        ret_val_list = routes.attach(collect_routes(query.details))
+    metrics.record(timer)
+    return ret_val_list
+
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    """Start a form query in the background"""
+    req = Request(request.cookies.get("form"))
+    job = jobs.submit(run_job, req)
+    if job is None:
+        return {"error": "too many queries are running, try again later"}, 503
+    return job.to_dict(), 202
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    """The status, progress and, once done, result of a background query"""
+    job = jobs.get(job_id)
+    if job is None:
+        return {"error": "no such job"}, 404
+    return job.to_dict()
+
+
+@app.route("/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    """Cancel a background query"""
+    job = jobs.get(job_id)
+    if job is None:
+        return {"error": "no such job"}, 404
+    job.cancel()
+    return job.to_dict()
+
+
+@app.route("/jobs/<job_id>/stream")
+def stream_job(job_id):
+    """Server-sent events with the progress of a background query"""
+    job = jobs.get(job_id)
+    if job is None:
+        return {"error": "no such job"}, 404
+
+    def events():
+        while True:
+            state = job.to_dict()
+            yield f"data: {json.dumps(state)}\n\n"
+            if job.finished is not None:
+                return
+            time.sleep(0.5)
+
+    return Response(events(), mimetype="text/event-stream")
@@ -0,0 +1,55 @@
+"""cache module for keeping the most recently used results"""
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    ResultCache class, a thread safe least recently used cache capped by size
+    Attributes:
+        max_bytes: most bytes of results kept, 0 to cache nothing
+        sizeof: function returning the size of a result in bytes
+        nbytes: bytes of results currently kept
+    """
+
+    def __init__(self, max_bytes, sizeof=len):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get a result, or None if it is not cached
+        Parameters:
+            key: hashable key of the result
+        """
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is None:
+                return None
+            self._results.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, result):
+        """
+        Cache a result, dropping the least recently used ones until it fits;
+        results larger than max_bytes are not cached
+        Parameters:
+            key: hashable key of the result
+            result: the result
+        """
+        size = self.sizeof(result)
+        if self.max_bytes == 0 or size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._results.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self._results[key] = (result, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, dropped) = self._results.popitem(last=False)
+                self.nbytes -= dropped
@@ -1,6 +1,34 @@
 """flight info module for flight info class"""
 import datetime
+import logging
+import math
+
+import numpy as np
 import pandas as pd
+from cache import ResultCache
+
+logger = logging.getLogger(__name__)
+
+# Bytes of bit-packed predicate masks kept for re-use by later queries; a mask
+# over a full year of about 6M flights packs into about 750KB
+MASK_CACHE_BYTES = 32 * 1024 * 1024
+
+
+def parse_distance(value):
+    """
+    Parse a distance bound from the frontend
+    Parameters:
+        value: distance in kilometers as text
+    Returns: the distance, or None for no bound if value is empty or not a
+        number
+    """
+    try:
+        distance = float(value)
+    except ValueError:
+        if value != "":
+            logger.warning("Ignoring distance bound %r", value)
+        return None
+    return None if math.isnan(distance) else distance
 
 
 class FlightInfo:
@@ -8,9 +36,17 @@ class FlightInfo:
     FlightInfo class
     Attributes:
         details: pandas dataframe with flight details
+        full_data: pandas dataframe with every flight, used to reset filters
+        metrics: optional MetricsRegistry that counts mask cache lookups
     """
 
-    def __init__(self, filename):
+    def __init__(self, filename, metrics=None):
+        """
+        Parameters:
+            filename: csv file with flight details, or a dataframe that has
+                already been through this constructor
+            metrics: optional MetricsRegistry that counts mask cache lookups
+        """
         columns = [
             "YEAR",
             "MONTH",
@@ -53,28 +89,67 @@ class FlightInfo:
             "CARGO": bool,
         }
 
-        self.details = pd.read_csv(filename, usecols=columns, dtype=data_types)
+        if isinstance(filename, pd.DataFrame):
+            # already prepared, e.g. loaded from a FlightStore
+            self.details = filename.reset_index(drop=True)
+        else:
+            self.details = pd.read_csv(filename, usecols=columns, dtype=data_types)
 
-        self.details["DEPARTURE_TIME"] = self.details["DEPARTURE_TIME"].str.zfill(4)
+            self.details["DEPARTURE_TIME"] = self.details["DEPARTURE_TIME"].str.zfill(4)
 
-        self.details["HOUR"] = self.details["DEPARTURE_TIME"].str[:2]
-        self.details["MINUTE"] = self.details["DEPARTURE_TIME"].str[2:]
+            self.details["HOUR"] = self.details["DEPARTURE_TIME"].str[:2]
+            self.details["MINUTE"] = self.details["DEPARTURE_TIME"].str[2:]
 
-        self.details["DEPARTURE_TIME"] = pd.to_datetime(
-            self.details[["YEAR", "MONTH", "DAY", "HOUR", "MINUTE"]]
-        )
+            self.details["DEPARTURE_TIME"] = pd.to_datetime(
+                self.details[["YEAR", "MONTH", "DAY", "HOUR", "MINUTE"]]
+            )
 
-        self.details["ELAPSED_TIME"] = pd.to_timedelta(
-            self.details["ELAPSED_TIME"], unit="minute"
-        )
+            self.details["ELAPSED_TIME"] = pd.to_timedelta(
+                self.details["ELAPSED_TIME"], unit="minute"
+            )
 
-        self.details["ARRIVAL_TIME"] = (
-            self.details["DEPARTURE_TIME"] + self.details["ELAPSED_TIME"]
-        )
+            self.details["ARRIVAL_TIME"] = (
+                self.details["DEPARTURE_TIME"] + self.details["ELAPSED_TIME"]
+            )
 
         # copy of full data for resetting filters
         self.full_data = self.details.copy()
 
+        # boolean masks over full_data keyed by normalized predicate value, so a
+        # query that changes one filter only recomputes that filter's mask
+        self.metrics = metrics
+        self._mask_cache = ResultCache(MASK_CACHE_BYTES, lambda mask: mask.nbytes)
+
+    @property
+    def details(self):
+        """
+        pandas dataframe with the flights that passed the filters so far
+        """
+        if self._selection is not None:
+            selection = self._selection
+            self._selection = None
+            if self._details is self.full_data:
+                self._details = self._details[selection]
+            else:
+                # full_data has a RangeIndex, so the labels of details are positions
+                self._details = self._details[selection[self._details.index.to_numpy()]]
+        return self._details
+
+    @details.setter
+    def details(self, details):
+        self._details = details
+        self._selection = None
+
+    def __len__(self):
+        """
+        Number of flights that passed the filters so far, without selecting them
+        """
+        if self._selection is None:
+            return len(self._details)
+        if self._details is self.full_data:
+            return int(np.count_nonzero(self._selection))
+        return int(np.count_nonzero(self._selection[self._details.index.to_numpy()]))
+
     def filter_by_location(self, origin_type, origin_values, dest_type, dest_values):
         """
         Filter by origin and destination
@@ -94,31 +169,31 @@ class FlightInfo:
                 dest_values.remove(i)
                 dest_values.append("UA")
 
-        if origin_type == "airport":
-            self.details = self.details[
-                self.details["ORIGIN_AIRPORT"].isin(origin_values)
-            ]
-        elif origin_type == "country":
-            self.details = self.details[
-                self.details["ORIGIN_COUNTRY"].isin(origin_values)
-            ]
-        elif origin_type == "continent":
-            self.details = self.details[
-                self.details["ORIGIN_CONTINENT"].isin(origin_values)
-            ]
+        origin_columns = {
+            "airport": "ORIGIN_AIRPORT",
+            "country": "ORIGIN_COUNTRY",
+            "continent": "ORIGIN_CONTINENT",
+        }
+        dest_columns = {
+            "airport": "DESTINATION_AIRPORT",
+            "country": "DESTINATION_COUNTRY",
+            "continent": "DESTINATION_CONTINENT",
+        }
 
-        if dest_type == "airport":
-            self.details = self.details[
-                self.details["DESTINATION_AIRPORT"].isin(dest_values)
-            ]
-        elif dest_type == "country":
-            self.details = self.details[
-                self.details["DESTINATION_COUNTRY"].isin(dest_values)
-            ]
-        elif dest_type == "continent":
-            self.details = self.details[
-                self.details["DESTINATION_CONTINENT"].isin(dest_values)
-            ]
+        for columns, location_type, values in (
+            (origin_columns, origin_type, origin_values),
+            (dest_columns, dest_type, dest_values),
+        ):
+            if location_type in columns:
+                column = columns[location_type]
+                self._apply_mask(
+                    self._mask(
+                        (column, frozenset(values)),
+                        lambda column=column, values=values: self.full_data[
+                            column
+                        ].isin(values),
+                    )
+                )
 
     def filter_by_time(self, start_date, start_time, end_date, end_time):
         """
@@ -136,9 +211,13 @@ class FlightInfo:
 
         arrive_time = datetime.datetime.strptime(parsed_end, "%Y-%m-%d-%H-%M")
 
-        self.details = self.details[self.details["DEPARTURE_TIME"] > depart_time]
-
-        self.details = self.details[self.details["ARRIVAL_TIME"] < arrive_time]
+        self._apply_mask(
+            self._mask(
+                ("TIME", depart_time, arrive_time),
+                lambda: (self.full_data["DEPARTURE_TIME"] > depart_time)
+                & (self.full_data["ARRIVAL_TIME"] < arrive_time),
+            )
+        )
 
     def filter_by_day_of_week(self, days):
         """
@@ -151,7 +230,12 @@ class FlightInfo:
             if days[k] == "true":
                 selected_days.append(k)
 
-        self.details = self.details[self.details["DAY_OF_WEEK"].isin(selected_days)]
+        self._apply_mask(
+            self._mask(
+                ("DAY_OF_WEEK", frozenset(selected_days)),
+                lambda: self.full_data["DAY_OF_WEEK"].isin(selected_days),
+            )
+        )
 
     def filter_by_airline(self, airlines):
         """
@@ -159,7 +243,12 @@ class FlightInfo:
         Parameters:
             airlines: list of airlines to filter by
         """
-        self.details = self.details[self.details["AIRLINE"].isin(airlines)]
+        self._apply_mask(
+            self._mask(
+                ("AIRLINE", frozenset(airlines)),
+                lambda: self.full_data["AIRLINE"].isin(airlines),
+            )
+        )
 
     def filter_by_cargo(self, is_cargo, is_passenger):
         """
@@ -169,15 +258,75 @@ class FlightInfo:
             is_passenger: boolean for if passenger flights should be included
         """
         if is_cargo == "true" and is_passenger == "false":
-            self.details = self.details[self.details["CARGO"] == 1]
+            self._apply_mask(
+                self._mask(("CARGO", True), lambda: self.full_data["CARGO"] == 1)
+            )
         elif is_cargo == "false" and is_passenger == "true":
-            self.details = self.details[self.details["CARGO"] == 0]
+            self._apply_mask(
+                self._mask(("CARGO", False), lambda: self.full_data["CARGO"] == 0)
+            )
+
+    def filter_by_distance(self, routes, min_distance, max_distance):
+        """
+        Filter by great circle distance
+        Parameters:
+            routes: RouteTable with the distance of each airport pair
+            min_distance: shortest distance in kilometers, or "" for no minimum
+            max_distance: longest distance in kilometers, or "" for no maximum;
+                values that are not numbers are ignored like ""
+        """
+        low = parse_distance(min_distance)
+        high = parse_distance(max_distance)
+        if low is None and high is None:
+            return
+
+        low = 0.0 if low is None else low
+        high = float("inf") if high is None else high
+        self._apply_mask(
+            self._mask(
+                ("DISTANCE", low, high),
+                lambda: routes.distances(self.full_data).between(low, high),
+            )
+        )
+
+    def _mask(self, key, compute):
+        """
+        Get the boolean mask over full_data for a predicate, computing it on a miss
+        Parameters:
+            key: hashable, normalized value of the predicate
+            compute: function returning the predicate as a boolean series
+        """
+        packed = self._mask_cache.get(key)
+
+        if self.metrics is not None:
+            self.metrics.record_cache("mask", packed is not None)
+
+        if packed is None:
+            mask = compute().to_numpy(dtype=bool, na_value=False)
+            self._mask_cache.put(key, np.packbits(mask))
+            return mask
+
+        return np.unpackbits(packed, count=len(self.full_data)).view(bool)
+
+    def _apply_mask(self, mask):
+        """
+        Intersect a predicate with the filters so far; the rows are only
+        selected from details once, the next time details is read
+        Parameters:
+            mask: boolean numpy array aligned with full_data
+        """
+        if self._selection is None:
+            self._selection = mask
+        else:
+            self._selection = self._selection & mask
 
-    def filter_by_added(self, req):
+    def filter_by_added(self, req, progress=None):
         """
         Filter by added
         Parameters:
             req: request object containing start and end dates
+            progress: optional function called as progress(index) for each
+                flight compared; it may raise to stop the comparison
         """
         parsed_start1 = (
             req.start_date + "-" + req.start_time[:2] + "-" + req.start_time[2:]
@@ -219,6 +368,8 @@ class FlightInfo:
         # time_delta = pd.to_timedelta(depart2-depart1)
         added_flights = flights2.copy()
         for index, f in flights2.iterrows():
+            if progress is not None:
+                progress(index)
             # check_time = (f["DEPARTURE_TIME"] - time_delta)
             temp = flights1[
                 (flights1["DAY_OF_WEEK"] == f["DAY_OF_WEEK"])
@@ -233,11 +384,13 @@ class FlightInfo:
 
         self.details = added_flights
 
-    def filter_by_removed(self, req):
+    def filter_by_removed(self, req, progress=None):
         """
         Filter by removed
         Parameters:
             req: request object containing start and end dates
+            progress: optional function called as progress(index) for each
+                flight compared; it may raise to stop the comparison
         """
         parsed_start1 = (
             req.start_date + "-" + req.start_time[:2] + "-" + req.start_time[2:]
@@ -279,6 +432,8 @@ class FlightInfo:
         # time_delta = pd.to_timedelta(depart2-depart1)
         removed_flights = flights1.copy()
         for index, f in flights1.iterrows():
+            if progress is not None:
+                progress(index)
             # check_time = (f["DEPARTURE_TIME"] + time_delta)
             temp = flights2[
                 (flights2["DAY_OF_WEEK"] == f["DAY_OF_WEEK"])
@@ -293,11 +448,15 @@ class FlightInfo:
 
         self.details = removed_flights
 
-    def filter_by_stops(self, req):
+    def filter_by_stops(self, req, progress=None):
         """
         Filter by stops
             parameters:
                 stops: number of stops
+                progress: optional function called as progress(destination,
+                    held_bytes) for each destination searched and once more
+                    for the result, with the bytes of the frames the search
+                    holds; it may raise to stop the search
         """
         origin = req.origin_values
         # print((origin))
@@ -315,6 +474,7 @@ class FlightInfo:
         path = []
         flightinfo = []
         temp = []
+        held = HeldFrames()
         if int(stops) > 0:
             stop_helper(
                 self.full_data,
@@ -328,9 +488,13 @@ class FlightInfo:
                 path,
                 flightinfo,
                 temp,
+                progress,
+                held,
             )
             flatten = [element for sublist in flightinfo for element in sublist]
             combined = pd.concat(flatten).drop_duplicates()
+            if progress is not None:
+                progress("result", held.nbytes + frame_bytes(combined))
             eu = ["EU"]
             KATL = ["KATL"]
             KLAX = ["KLAX"]
@@ -340,6 +504,64 @@ class FlightInfo:
             self.details = combined
 
 
+def frame_bytes(frame):
+    """
+    Bytes of the columns of a dataframe, without the index
+    Parameters:
+        frame: pandas dataframe
+    """
+    return int(frame.memory_usage(index=False).sum())
+
+
+class HeldFrames:
+    """
+    HeldFrames class, the frames a layover search holds on to: one per level
+    of the search in progress, and every frame kept for the result
+    Attributes:
+        nbytes: bytes of the distinct frames held
+    """
+
+    def __init__(self):
+        self.nbytes = 0
+        # frames kept for the result stay alive until the search ends, so
+        # their ids are not reused
+        self._kept = set()
+        self._stack = []
+
+    def push(self, frame):
+        """
+        Hold the frame of a level of the search
+        Parameters:
+            frame: pandas dataframe
+        """
+        size = frame_bytes(frame)
+        self._stack.append((id(frame), size))
+        if id(frame) not in self._kept:
+            self.nbytes += size
+
+    def pop(self):
+        """
+        Release the frame of the innermost level of the search
+        """
+        key, size = self._stack.pop()
+        if key not in self._kept:
+            self.nbytes -= size
+
+    def keep(self, frames):
+        """
+        Hold frames for the result until the search ends
+        Parameters:
+            frames: list of pandas dataframes
+        """
+        stacked = {key for key, _ in self._stack}
+        for frame in frames:
+            if id(frame) in self._kept:
+                continue
+            self._kept.add(id(frame))
+            if id(frame) not in stacked:
+                self.nbytes += frame_bytes(frame)
+
+
 def stop_helper(
     flights,
     flights_copy,
@@ -352,13 +574,19 @@ def stop_helper(
     path=[],
     flightinfo=[],
     temp=[],
+    progress=None,
+    held=None,
 ):
+    if held is None:
+        held = HeldFrames()
+
     if origin == destination:
-        print("end")
+        logger.debug("end")
         path.append(destination)
         if path not in visited:
             visited.append(path)
             flightinfo.append(temp)
+            held.keep(temp)
         return
 
     # make a copy of all flights
@@ -367,24 +595,32 @@ def stop_helper(
     flights_copy = flights_copy.query("DEPARTURE_TIME > @depart_time")
     flights_copy = flights_copy[flights_copy["ARRIVAL_TIME"] < arrive_time]
 
-    for dest in flights_copy["DESTINATION_AIRPORT"]:
-        if dest not in path:
-            print(dest)
-            lst_dest = [dest]
-            path.append(origin)
-            temp.append(flights_copy)
-            stop_helper(
-                flights,
-                flights_copy,
-                lst_dest,
-                destination,
-                int(stops),
-                depart_time,
-                arrive_time,
-                visited,
-                path,
-                flightinfo,
-                temp,
-            )
-            temp = []
-            path = []
+    held.push(flights_copy)
+    try:
+        for dest in flights_copy["DESTINATION_AIRPORT"]:
+            if dest not in path:
+                logger.debug("stop search reached %s", dest)
+                if progress is not None:
+                    progress(dest, held.nbytes)
+                lst_dest = [dest]
+                path.append(origin)
+                temp.append(flights_copy)
+                stop_helper(
+                    flights,
+                    flights_copy,
+                    lst_dest,
+                    destination,
+                    int(stops),
+                    depart_time,
+                    arrive_time,
+                    visited,
+                    path,
+                    flightinfo,
+                    temp,
+                    progress,
+                    held,
+                )
+                temp = []
+                path = []
+    finally:
+        held.pop()
@@ -0,0 +1,87 @@
+"""heatmap module for counting flights by airport, day of week and hour"""
+import numpy as np
+import pandas as pd
+
+DAYS = 7
+HOURS = 24
+
+
+def bincount_grid(groups, days, hours, size):
+    """
+    Count flights per group, day of week and hour
+    Parameters:
+        groups: numpy array of integer group codes, -1 for flights without a
+            group, which are not counted
+        days: numpy array of days of week from 0 to 6
+        hours: numpy array of hours from 0 to 23
+        size: number of groups
+    Returns: numpy array of shape (size, DAYS, HOURS)
+    """
+    known = groups >= 0
+    index = (groups[known] * DAYS + days[known]) * HOURS + hours[known]
+    return np.bincount(index, minlength=size * DAYS * HOURS).reshape(size, DAYS, HOURS)
+
+
+def traffic_heatmap(details):
+    """
+    Count departures and arrivals per airport and per airline, day of week
+    and hour
+    Parameters:
+        details: pandas dataframe with the matching flights
+    Returns: dictionary with the airport and airline codes and their counts as
+        nested [code][day][hour] lists; days follow the DAY_OF_WEEK column, so
+        index 0 is day "1"; flights without a valid day of week or times are
+        left out, as are the airports or airline they are missing
+    """
+    days = pd.to_numeric(details["DAY_OF_WEEK"], errors="coerce").to_numpy(
+        dtype=float, na_value=np.nan
+    )
+    valid = (
+        (days >= 1)
+        & (days <= DAYS)
+        & details["DEPARTURE_TIME"].notna().to_numpy()
+        & details["ARRIVAL_TIME"].notna().to_numpy()
+    )
+    details = details[valid]
+
+    airport_codes, airports = pd.factorize(
+        pd.concat([details["ORIGIN_AIRPORT"], details["DESTINATION_AIRPORT"]]),
+        sort=True,
+    )
+    origin_codes = airport_codes[: len(details)]
+    destination_codes = airport_codes[len(details) :]
+    airline_codes, airlines = pd.factorize(details["AIRLINE"], sort=True)
+
+    departure_days = days[valid].astype(int) - 1
+    departure_hours = details["DEPARTURE_TIME"].dt.hour.to_numpy()
+
+    # arrivals can land on a later day than they left
+    days_later = (
+        details["ARRIVAL_TIME"].dt.normalize()
+        - details["DEPARTURE_TIME"].dt.normalize()
+    ).dt.days.to_numpy()
+    arrival_days = (departure_days + days_later) % DAYS
+    arrival_hours = details["ARRIVAL_TIME"].dt.hour.to_numpy()
+
+    departures = bincount_grid(
+        origin_codes, departure_days, departure_hours, len(airports)
+    )
+    arrivals = bincount_grid(
+        destination_codes, arrival_days, arrival_hours, len(airports)
+    )
+    airline_departures = bincount_grid(
+        airline_codes, departure_days, departure_hours, len(airlines)
+    )
+    airline_arrivals = bincount_grid(
+        airline_codes, arrival_days, arrival_hours, len(airlines)
+    )
+
+    return {
+        "days": [str(day) for day in range(1, DAYS + 1)],
+        "airports": [str(airport) for airport in airports],
+        "departures": departures.tolist(),
+        "arrivals": arrivals.tolist(),
+        "airlines": [str(airline) for airline in airlines],
+        "airline_departures": airline_departures.tolist(),
+        "airline_arrivals": airline_arrivals.tolist(),
+    }
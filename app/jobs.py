@@ -0,0 +1,185 @@
+"""jobs module for running long queries in the background"""
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Seconds a finished job is kept around for its result to be fetched
+JOB_RETENTION = 10 * 60
+
+# Most finished jobs kept around at once; the oldest are dropped first
+JOB_MAX_RETAINED = 32
+
+
+class JobCancelled(Exception):
+    """Raised inside a job to stop it when it is cancelled or over budget"""
+
+
+class Job:
+    """
+    Job class
+    Attributes:
+        job_id: id the frontend uses to poll or cancel the job
+        status: queued, running, done, failed or cancelled
+        error: reason the job failed, if it did
+        result: return value of the job once it is done
+        explored: number of progress updates, e.g. destinations searched
+        memory: bytes of the intermediate results the job last reported
+            holding, e.g. the frames a layover search keeps
+        peak_memory: most bytes the job reported holding at once
+        stages: list of (name, seconds, rows_in, rows_out) of finished stages
+    """
+
+    def __init__(self, time_budget, memory_budget):
+        self.job_id = uuid.uuid4().hex
+        self.status = "queued"
+        self.error = None
+        self.result = None
+        self.explored = 0
+        self.memory = 0
+        self.peak_memory = 0
+        self.stages = []
+        self.time_budget = time_budget
+        self.memory_budget = memory_budget
+        self.started = None
+        self.finished = None
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        """
+        Ask the job to stop at its next progress update
+        """
+        self._cancel.set()
+
+    def cancelled(self):
+        """
+        True if the job has been asked to stop
+        """
+        return self._cancel.is_set()
+
+    def check(self):
+        """
+        Stop the job if it is cancelled or over budget, e.g. between stages
+        """
+        if self.cancelled():
+            raise JobCancelled("cancelled")
+        if time.monotonic() - self.started > self.time_budget:
+            raise JobCancelled(f"time budget of {self.time_budget}s exceeded")
+        if self.memory > self.memory_budget:
+            raise JobCancelled(f"memory budget of {self.memory_budget} bytes exceeded")
+
+    def progress(self, _item=None, held_bytes=None):
+        """
+        Record progress and stop the job if it is cancelled or over budget
+        Parameters:
+            _item: what was just searched, e.g. a destination airport
+            held_bytes: optional bytes of the intermediate results the job
+                holds right now
+        """
+        self.explored += 1
+        if held_bytes is not None:
+            self.memory = held_bytes
+            self.peak_memory = max(self.peak_memory, held_bytes)
+        self.check()
+
+    def to_dict(self):
+        """
+        Describe the job for the frontend
+        """
+        now = time.monotonic()
+        ret_val = {
+            "id": self.job_id,
+            "status": self.status,
+            "explored": self.explored,
+            "memory": self.memory,
+            "peak_memory": self.peak_memory,
+            "stages": [name for name, _, _, _ in self.stages],
+            "elapsed": round((self.finished or now) - (self.started or now), 3),
+        }
+        if self.error is not None:
+            ret_val["error"] = self.error
+        if self.status == "done":
+            ret_val["result"] = self.result
+        return ret_val
+
+
+class JobManager:
+    """
+    JobManager class
+    Attributes:
+        max_pending: most jobs that can be queued or running at once
+        time_budget: seconds each job may run for
+        memory_budget: bytes of intermediate results each job may hold
+    """
+
+    def __init__(self, workers, max_pending, time_budget, memory_budget):
+        self.max_pending = max_pending
+        self.time_budget = time_budget
+        self.memory_budget = memory_budget
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="query-job"
+        )
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args):
+        """
+        Queue a job, or return None if too many jobs are pending
+        Parameters:
+            func: function called as func(job, *args), returning the result
+            args: extra arguments for func
+        """
+        with self._lock:
+            self._prune()
+            pending = [
+                job
+                for job in self._jobs.values()
+                if job.status in ("queued", "running")
+            ]
+            if len(pending) >= self.max_pending:
+                return None
+            job = Job(self.time_budget, self.memory_budget)
+            self._jobs[job.job_id] = job
+
+        self._executor.submit(self._run, job, func, args)
+        return job
+
+    def get(self, job_id):
+        """
+        Get a job by id, or None if it does not exist
+        Parameters:
+            job_id: id of the job
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, func, args):
+        job.started = time.monotonic()
+        try:
+            # cancelled while still queued
+            if job.cancelled():
+                raise JobCancelled("cancelled")
+            job.status = "running"
+            job.result = func(job, *args)
+            job.status = "done"
+        except JobCancelled as error:
+            job.status = "cancelled" if str(error) == "cancelled" else "failed"
+            job.error = str(error)
+        except Exception as error:  # pylint: disable=broad-except
+            job.status = "failed"
+            job.error = repr(error)
+        finally:
+            job.finished = time.monotonic()
+
+    def _prune(self):
+        now = time.monotonic()
+        finished = sorted(
+            (job for job in self._jobs.values() if job.finished is not None),
+            key=lambda job: job.finished,
+        )
+        for index, job in enumerate(finished):
+            if (
+                now - job.finished > JOB_RETENTION
+                or len(finished) - index > JOB_MAX_RETAINED
+            ):
+                del self._jobs[job.job_id]
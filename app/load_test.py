@@ -0,0 +1,441 @@
+"""
+Load test for a running Flight Tracker server
+
+Replays a mix of form cookies, laid out like Request.parse_cookie expects,
+from many concurrent clients and reports throughput, latency percentiles,
+the result cache hit ratio and the memory growth of each server worker.
+
+The server caches response bodies by page and cookie, so with the cache on
+most timed requests are cache lookups, and the mismatch check compares a
+cached body with itself. Latencies and mismatches are only meaningful with
+the cache off; start the server with FLIGHT_TRACKER_RESULT_CACHE_BYTES=0.
+
+Example:
+    FLIGHT_TRACKER_RESULT_CACHE_BYTES=0 flask run
+    python load_test.py --url http://127.0.0.1:5000 --clients 16 --duration 30
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+
+AIRPORTS_FILENAME = "./static/airports.json"
+AIRLINES_FILENAME = "./static/airlines.json"
+
+# Defaults of filter_script.js
+DEFAULT_START = ("2000-01-01", "0400")
+DEFAULT_END = ("2023-12-31", "1700")
+DEFAULT_SECONDARY_START = ("2010-01-01", "0400")
+DEFAULT_SECONDARY_END = ("2012-12-31", "1700")
+
+MEMORY_PATTERN = re.compile(r'process_resident_memory_bytes\{pid="(\d+)"\} (\d+)')
+CACHE_PATTERN = re.compile(
+    r'flight_tracker_cache_(hits|misses)_total\{cache="results"\} (\d+)'
+)
+
+
+def build_cookie(
+    start=DEFAULT_START,
+    end=DEFAULT_END,
+    days=(True,) * 7,
+    origin=("airport", []),
+    destination=("airport", []),
+    layovers=0,
+    airlines=(),
+    cargo=True,
+    passenger=True,
+    secondary_start=DEFAULT_SECONDARY_START,
+    secondary_end=DEFAULT_SECONDARY_END,
+    find_added=False,
+    find_removed=False,
+    min_distance="",
+    max_distance="",
+):
+    """
+    Build a form cookie the way display_routes_script.js does
+    Parameters:
+        start, end: (date, time) of the earliest departure and latest arrival
+        days: booleans for Sunday through Saturday
+        origin, destination: (type, values) location filters
+        layovers: most layovers
+        airlines: airline codes
+        cargo, passenger: which kinds of flights to include
+        secondary_start, secondary_end: (date, time) of the advanced filter
+        find_added, find_removed: which advanced filter to run
+        min_distance, max_distance: route distance bounds in kilometers, ""
+            for no bound
+    Returns: the cookie value, with commas escaped like escape() does
+    """
+
+    def text(value):
+        return str(value).lower() if isinstance(value, bool) else str(value)
+
+    fields = [start[0], start[1], end[0], end[1]]
+    fields += [text(day) for day in days]
+    fields += [origin[0], "%2C".join(origin[1])]
+    fields += [destination[0], "%2C".join(destination[1])]
+    fields += [str(layovers), "%2C".join(airlines), text(cargo), text(passenger)]
+    fields += [secondary_start[0], secondary_start[1]]
+    fields += [secondary_end[0], secondary_end[1]]
+    fields += [text(find_added), text(find_removed)]
+    fields += [str(min_distance), str(max_distance)]
+    return "--".join(fields)
+
+
+def random_cookie(rng, airports, airlines, layover_share, distance_share):
+    """
+    Build a cookie like one a user of the filter menu could send
+    Parameters:
+        rng: random.Random to draw from
+        airports: list of airport codes
+        airlines: list of airline codes
+        layover_share: fraction of cookies that search for layovers
+        distance_share: fraction of cookies that bound the route distance
+    """
+    cargo, passenger = rng.choice([(True, True)] * 4 + [(True, False), (False, True)])
+    days = (True,) * 7
+    if rng.random() < 0.3:
+        days = tuple(rng.random() < 0.6 for _ in range(7))
+
+    year = rng.randint(2015, 2023)
+    start = DEFAULT_START
+    end = DEFAULT_END
+    if rng.random() < 0.5:
+        start = (f"{year}-01-01", "0000")
+        end = (f"{year}-{rng.randint(1, 12):02d}-28", "2359")
+
+    # a minimum, a maximum or both, in kilometers
+    min_distance = ""
+    max_distance = ""
+    if rng.random() < distance_share:
+        low = rng.choice([0, 500, 1000, 2000, 5000])
+        bounds = rng.choice(["min", "max", "both"])
+        if bounds != "max":
+            min_distance = low
+        if bounds != "min":
+            max_distance = low + rng.choice([1000, 3000, 10000])
+
+    return build_cookie(
+        start=start,
+        end=end,
+        days=days,
+        origin=("airport", rng.sample(airports, rng.randint(1, len(airports)))),
+        destination=("airport", rng.sample(airports, rng.randint(1, len(airports)))),
+        layovers=1 if rng.random() < layover_share else 0,
+        airlines=rng.sample(airlines, rng.randint(1, len(airlines))),
+        cargo=cargo,
+        passenger=passenger,
+        find_added=rng.random() < 0.05,
+        min_distance=min_distance,
+        max_distance=max_distance,
+    )
+
+
+def scrape_metrics(url):
+    """
+    Scrape /metrics of the worker that answers it
+    Parameters:
+        url: base url of the server
+    Returns: the metrics text, empty if unavailable
+    """
+    try:
+        with urllib.request.urlopen(url + "/metrics", timeout=10) as response:
+            return response.read().decode("utf8")
+    except (urllib.error.URLError, OSError):
+        return ""
+
+
+def memory_by_worker(url):
+    """
+    Scrape the resident memory of the worker that answers /metrics
+    Parameters:
+        url: base url of the server
+    Returns: dictionary of pid to bytes, empty if unavailable
+    """
+    text = scrape_metrics(url)
+    return {pid: int(memory) for pid, memory in MEMORY_PATTERN.findall(text)}
+
+
+def result_cache_lookups(url):
+    """
+    Scrape the result cache hits and misses of the worker that answers /metrics
+    Parameters:
+        url: base url of the server
+    Returns: dictionary with the hits and misses, missing ones counted as 0,
+        or None if /metrics is unavailable
+    """
+    text = scrape_metrics(url)
+    if not text:
+        return None
+    counts = {"hits": 0, "misses": 0}
+    for kind, count in CACHE_PATTERN.findall(text):
+        counts[kind] = int(count)
+    return counts
+
+
+def percentile(values, fraction):
+    """
+    Nearest rank percentile of sorted values
+    Parameters:
+        values: sorted list of numbers
+        fraction: percentile between 0 and 1
+    """
+    if not values:
+        return float("nan")
+    rank = max(int(round(fraction * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+class LoadTest:
+    """
+    LoadTest class
+    Attributes:
+        url: base url of the server
+        paths: pages to request, picked at random
+        cookies: cookies to replay
+        latencies: seconds per page of every successful request
+        errors: count of failed requests per reason
+        mismatches: responses that differ from the serial warm up response
+        memory: dictionary of pid to (first, last, highest) resident bytes
+        cache_lookups: result cache hits and misses during the run, None if
+            /metrics is unavailable
+    """
+
+    def __init__(self, url, paths, cookies, timeout):
+        self.url = url.rstrip("/")
+        self.paths = paths
+        self.cookies = cookies
+        self.timeout = timeout
+        self.latencies = {path: [] for path in paths}
+        self.errors = {}
+        self.mismatches = 0
+        self.memory = {}
+        self.cache_lookups = None
+        self.expected = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def fetch(self, path, cookie):
+        """
+        Request a page with a form cookie
+        Parameters:
+            path: page to request, e.g. /form
+            cookie: form cookie value
+        Returns: the response body
+        """
+        req = urllib.request.Request(
+            self.url + path, headers={"Cookie": "form=" + cookie}
+        )
+        with urllib.request.urlopen(req, timeout=self.timeout) as response:
+            return response.read()
+
+    def warm_up(self):
+        """
+        Request every page and cookie once, one at a time, to record the
+        responses the concurrent run should reproduce
+        """
+        for path in self.paths:
+            for cookie in self.cookies:
+                try:
+                    self.expected[(path, cookie)] = self.fetch(path, cookie)
+                except (urllib.error.URLError, OSError) as error:
+                    self._error(error)
+
+    def client(self, seed):
+        """
+        Send requests until the test stops
+        Parameters:
+            seed: seed for this client's choice of pages and cookies
+        """
+        rng = random.Random(seed)
+        while not self._stop.is_set():
+            path = rng.choice(self.paths)
+            cookie = rng.choice(self.cookies)
+            start = time.perf_counter()
+            try:
+                body = self.fetch(path, cookie)
+            except (urllib.error.URLError, OSError) as error:
+                self._error(error)
+                continue
+            elapsed = time.perf_counter() - start
+
+            expected = self.expected.get((path, cookie))
+            with self._lock:
+                self.latencies[path].append(elapsed)
+                if expected is not None and body != expected:
+                    self.mismatches += 1
+
+    def sample_memory(self, interval):
+        """
+        Scrape worker memory until the test stops
+        Parameters:
+            interval: seconds between scrapes
+        """
+        while True:
+            for pid, memory in memory_by_worker(self.url).items():
+                first, _, highest = self.memory.get(pid, (memory, memory, memory))
+                self.memory[pid] = (first, memory, max(highest, memory))
+            if self._stop.wait(interval):
+                return
+
+    def run(self, clients, duration, memory_interval):
+        """
+        Run the concurrent part of the test
+        Parameters:
+            clients: number of concurrent clients
+            duration: seconds to run for
+            memory_interval: seconds between memory scrapes
+        Returns: seconds the test actually ran for
+        """
+        threads = [
+            threading.Thread(target=self.client, args=(seed,), daemon=True)
+            for seed in range(clients)
+        ]
+        sampler = threading.Thread(
+            target=self.sample_memory, args=(memory_interval,), daemon=True
+        )
+        before = result_cache_lookups(self.url)
+        sampler.start()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        self._stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        sampler.join()
+
+        after = result_cache_lookups(self.url)
+        if before is not None and after is not None:
+            self.cache_lookups = {
+                kind: max(after[kind] - before[kind], 0) for kind in ("hits", "misses")
+            }
+        return elapsed
+
+    def report(self, elapsed):
+        """
+        Format the results of the test
+        Parameters:
+            elapsed: seconds the test ran for
+        """
+        lines = []
+        total = sum(len(values) for values in self.latencies.values())
+        failed = sum(self.errors.values())
+        lines.append(
+            f"{total} requests in {elapsed:.1f}s: {total / elapsed:.1f} req/s, "
+            f"{failed} errors, {self.mismatches} mismatched responses"
+        )
+
+        lines.append(
+            f"{'page':<12}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+        )
+        for path, values in self.latencies.items():
+            values = sorted(values)
+            lines.append(
+                f"{path:<12}{len(values):>8}"
+                + "".join(
+                    f"{percentile(values, fraction) * 1000:>10.1f}"
+                    for fraction in (0.5, 0.95, 0.99)
+                )
+            )
+
+        if self.cache_lookups is None:
+            lines.append("result cache hit ratio unavailable, is /metrics enabled?")
+        else:
+            hits = self.cache_lookups["hits"]
+            lookups = hits + self.cache_lookups["misses"]
+            ratio = hits / lookups if lookups else 0.0
+            lines.append(
+                f"result cache: {hits} hits of {lookups} lookups "
+                f"({ratio:.1%} hit ratio)"
+            )
+            if hits:
+                lines.append(
+                    "warning: latencies include cached responses and mismatches "
+                    "compare cached bodies; restart the server with "
+                    "FLIGHT_TRACKER_RESULT_CACHE_BYTES=0"
+                )
+
+        for reason, count in sorted(self.errors.items()):
+            lines.append(f"error {reason}: {count}")
+
+        if not self.memory:
+            lines.append("worker memory unavailable, is /metrics enabled?")
+        for pid, (first, last, highest) in sorted(self.memory.items()):
+            lines.append(
+                f"worker {pid}: {first / 2**20:.1f} MiB -> {last / 2**20:.1f} MiB "
+                f"({(last - first) / 2**20:+.1f} MiB, peak {highest / 2**20:.1f} MiB)"
+            )
+        return "\n".join(lines)
+
+    def _error(self, error):
+        reason = getattr(error, "code", None) or type(error).__name__
+        with self._lock:
+            self.errors[str(reason)] = self.errors.get(str(reason), 0) + 1
+
+
+def main():
+    """
+    Run the load test from the command line
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument(
+        "--cookies", type=int, default=50, help="number of distinct cookies"
+    )
+    parser.add_argument(
+        "--paths",
+        default="/form,/lod,/heatmap",
+        help="comma separated pages to request",
+    )
+    parser.add_argument(
+        "--layovers",
+        type=float,
+        default=0.0,
+        help="fraction of cookies that search for layovers, which the pages "
+        "refuse with a 400 since those searches run through /jobs",
+    )
+    parser.add_argument(
+        "--distances",
+        type=float,
+        default=0.2,
+        help="fraction of cookies that bound the route distance",
+    )
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--memory-interval", type=float, default=1.0, help="seconds between scrapes"
+    )
+    args = parser.parse_args()
+
+    with open(AIRPORTS_FILENAME, encoding="utf8") as file:
+        airports = sorted(json.load(file))
+    with open(AIRLINES_FILENAME, encoding="utf8") as file:
+        airlines = sorted(json.load(file))
+
+    rng = random.Random(args.seed)
+    everywhere = ("airport", airports)
+    cookies = [
+        build_cookie(origin=everywhere, destination=everywhere, airlines=airlines)
+    ]
+    while len(cookies) < args.cookies:
+        cookies.append(
+            random_cookie(rng, airports, airlines, args.layovers, args.distances)
+        )
+
+    test = LoadTest(args.url, args.paths.split(","), cookies, args.timeout)
+    test.warm_up()
+    elapsed = test.run(args.clients, args.duration, args.memory_interval)
+    print(test.report(elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""lod module for aggregating routes into a bounded number of map edges"""
+import numpy as np
+import pandas as pd
+
+# Most edges returned for one zoom level
+MAX_EDGES = 500
+
+# Up to this many routes the map draws every route instead of aggregating
+MAX_DIRECT_ROUTES = 500
+
+# Clusters per side of a 256 pixel map tile, so a cluster is about 64 pixels
+CLUSTERS_PER_TILE = 4
+
+# From this zoom level on every airport is its own cluster
+MAX_CLUSTER_ZOOM = 8
+
+# Web Mercator stops at about 85 degrees north and south
+MAX_LATITUDE = 85.05
+
+
+def cluster_airports(airports, zoom):
+    """
+    Bucket airports into grid cells of the Web Mercator map at a zoom level
+    Parameters:
+        airports: pandas dataframe from routes.load_airports
+        zoom: map zoom level
+    Returns: pandas series mapping each airport to its cluster id
+    """
+    if zoom >= MAX_CLUSTER_ZOOM:
+        return pd.Series(airports.index, index=airports.index)
+
+    cells = CLUSTERS_PER_TILE * 2**zoom
+    lat = np.radians(airports["lat"].clip(-MAX_LATITUDE, MAX_LATITUDE))
+    x = (airports["lng"] + 180) / 360
+    y = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / np.pi) / 2
+
+    cell_x = np.floor(x * cells).astype(int).clip(0, cells - 1)
+    cell_y = np.floor(y * cells).astype(int).clip(0, cells - 1)
+    return f"{zoom}/" + cell_x.astype(str) + "/" + cell_y.astype(str)
+
+
+def count_routes(details):
+    """
+    Count the distinct origin, destination, airline and cargo routes
+    Parameters:
+        details: pandas dataframe with the matching flights
+    """
+    return details.groupby(
+        ["ORIGIN_AIRPORT", "DESTINATION_AIRPORT", "AIRLINE", "CARGO"],
+        observed=True,
+        dropna=False,
+    ).ngroups
+
+
+def aggregate_routes(details, airports, zoom, max_edges=MAX_EDGES):
+    """
+    Merge the airlines of each airport pair, bucket airports into clusters and
+    count the flights between clusters
+    Parameters:
+        details: pandas dataframe with the matching flights
+        airports: pandas dataframe from routes.load_airports
+        zoom: map zoom level
+        max_edges: most edges to return, busiest first
+    Returns: dictionary with the clusters, the weighted edges between them, the
+        number of distinct routes before aggregation, and how many edges and
+        flights were left out
+    """
+    counts = (
+        details.groupby(
+            ["ORIGIN_AIRPORT", "DESTINATION_AIRPORT", "AIRLINE", "CARGO"],
+            observed=True,
+        )
+        .size()
+        .rename("FLIGHTS")
+        .reset_index()
+    )
+
+    routes = len(counts)
+    placed = counts["ORIGIN_AIRPORT"].isin(airports.index) & counts[
+        "DESTINATION_AIRPORT"
+    ].isin(airports.index)
+    unplaced_flights = int(counts.loc[~placed, "FLIGHTS"].sum())
+    counts = counts[placed]
+
+    clusters = cluster_airports(airports, zoom)
+    counts = counts.assign(
+        FROM=clusters.reindex(counts["ORIGIN_AIRPORT"]).to_numpy(),
+        TO=clusters.reindex(counts["DESTINATION_AIRPORT"]).to_numpy(),
+        PASSENGER=~counts["CARGO"].astype(bool),
+    )
+
+    used = pd.unique(
+        pd.concat([counts["ORIGIN_AIRPORT"], counts["DESTINATION_AIRPORT"]])
+    )
+    members = airports.loc[used].assign(CLUSTER=clusters[used].to_numpy())
+    cluster_flights = (
+        pd.concat(
+            [
+                counts.groupby("FROM")["FLIGHTS"].sum(),
+                counts[counts["FROM"] != counts["TO"]].groupby("TO")["FLIGHTS"].sum(),
+            ]
+        )
+        .groupby(level=0)
+        .sum()
+    )
+
+    cluster_list = []
+    for cluster_id, group in members.groupby("CLUSTER"):
+        cluster_list.append(
+            {
+                "id": cluster_id,
+                "lat": round(float(group["lat"].mean()), 3),
+                "lng": round(float(group["lng"].mean()), 3),
+                "airports": sorted(group.index.tolist()),
+                "flights": int(cluster_flights.get(cluster_id, 0)),
+            }
+        )
+
+    # flights inside one cluster have no edge to draw at this zoom level
+    edges = (
+        counts[counts["FROM"] != counts["TO"]]
+        .groupby(["FROM", "TO"])
+        .agg(
+            FLIGHTS=("FLIGHTS", "sum"),
+            AIRLINES=("AIRLINE", lambda airlines: sorted(set(airlines))),
+            CARGO=("CARGO", "any"),
+            PASSENGER=("PASSENGER", "any"),
+        )
+        .sort_values("FLIGHTS", ascending=False)
+    )
+    dropped_edges = max(len(edges) - max_edges, 0)
+    edges = edges.head(max_edges)
+
+    edge_list = []
+    for (origin, destination), row in edges.iterrows():
+        edge_list.append(
+            {
+                "origin": origin,
+                "destination": destination,
+                "flights": int(row["FLIGHTS"]),
+                "airlines": list(row["AIRLINES"]),
+                "cargo": bool(row["CARGO"]),
+                "passenger": bool(row["PASSENGER"]),
+            }
+        )
+
+    return {
+        "zoom": zoom,
+        "routes": routes,
+        "clusters": cluster_list,
+        "edges": edge_list,
+        "dropped_edges": dropped_edges,
+        "unplaced_flights": unplaced_flights,
+    }
@@ -0,0 +1,163 @@
+"""metrics module for timing the stages of a query and exporting the results"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+def resident_memory():
+    """
+    Resident memory of this process in bytes, or None where /proc is missing
+    """
+    try:
+        with open("/proc/self/statm", encoding="utf8") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return None
+
+
+class QueryTimer:
+    """
+    QueryTimer class, one per request
+    Attributes:
+        stages: list of (name, seconds, rows_in, rows_out) tuples in run order
+        payload_bytes: size of the response body in bytes
+    """
+
+    def __init__(self, check=None):
+        """
+        Parameters:
+            check: optional function called before and after every stage; it
+                may raise to stop the query, e.g. Job.check
+        """
+        self.check = check
+        self.stages = []
+        self.payload_bytes = 0
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name, flights=None):
+        """
+        Time a stage of the query
+        Parameters:
+            name: name of the stage, used as the Server-Timing metric name
+            flights: optional FlightInfo object whose flights are counted
+                before and after the stage
+        """
+        if self.check is not None:
+            self.check()
+        rows_in = len(flights) if flights is not None else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            rows_out = len(flights) if flights is not None else None
+            self.stages.append((name, elapsed, rows_in, rows_out))
+        if self.check is not None:
+            self.check()
+
+    def total(self):
+        """
+        Seconds elapsed since the timer was created
+        """
+        return time.perf_counter() - self._start
+
+    def server_timing(self):
+        """
+        Format the stages as the value of a Server-Timing header
+        """
+        entries = []
+        for name, elapsed, rows_in, rows_out in self.stages:
+            entry = f"{name};dur={elapsed * 1000:.2f}"
+            if rows_in is not None:
+                entry += f';desc="{rows_in}->{rows_out} rows"'
+            entries.append(entry)
+        entries.append(f"total;dur={self.total() * 1000:.2f}")
+        return ", ".join(entries)
+
+
+class MetricsRegistry:
+    """
+    MetricsRegistry class, shared by all requests
+    Attributes:
+        requests: number of requests recorded
+        stage_seconds: total seconds spent per stage
+        stage_calls: number of times each stage ran
+        stage_rows_in: total rows going into each stage
+        stage_rows_out: total rows coming out of each stage
+        cache_hits: cache hits per cache name
+        cache_misses: cache misses per cache name
+        payload_bytes: total response bytes
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.stage_seconds = {}
+        self.stage_calls = {}
+        self.stage_rows_in = {}
+        self.stage_rows_out = {}
+        self.cache_hits = {}
+        self.cache_misses = {}
+        self.payload_bytes = 0
+
+    def record(self, timer):
+        """
+        Add the stages of a finished request to the totals
+        Parameters:
+            timer: QueryTimer of the finished request
+        """
+        with self._lock:
+            self.requests += 1
+            self.payload_bytes += timer.payload_bytes
+            for name, elapsed, rows_in, rows_out in timer.stages:
+                self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + elapsed
+                self.stage_calls[name] = self.stage_calls.get(name, 0) + 1
+                if rows_in is not None:
+                    self.stage_rows_in[name] = self.stage_rows_in.get(name, 0) + rows_in
+                    self.stage_rows_out[name] = (
+                        self.stage_rows_out.get(name, 0) + rows_out
+                    )
+
+    def record_cache(self, cache, hit):
+        """
+        Count a cache lookup
+        Parameters:
+            cache: name of the cache
+            hit: True if the lookup was a hit
+        """
+        with self._lock:
+            counts = self.cache_hits if hit else self.cache_misses
+            counts[cache] = counts.get(cache, 0) + 1
+
+    def prometheus(self):
+        """
+        Format the totals in the Prometheus text exposition format
+        """
+        with self._lock:
+            lines = [
+                "# TYPE flight_tracker_requests_total counter",
+                f"flight_tracker_requests_total {self.requests}",
+                "# TYPE flight_tracker_payload_bytes_total counter",
+                f"flight_tracker_payload_bytes_total {self.payload_bytes}",
+            ]
+            memory = resident_memory()
+            if memory is not None:
+                lines.append("# TYPE process_resident_memory_bytes gauge")
+                lines.append(
+                    f'process_resident_memory_bytes{{pid="{os.getpid()}"}} {memory}'
+                )
+            metrics = [
+                ("stage_seconds_total", "stage", self.stage_seconds),
+                ("stage_calls_total", "stage", self.stage_calls),
+                ("stage_rows_in_total", "stage", self.stage_rows_in),
+                ("stage_rows_out_total", "stage", self.stage_rows_out),
+                ("cache_hits_total", "cache", self.cache_hits),
+                ("cache_misses_total", "cache", self.cache_misses),
+            ]
+            for metric, label, values in metrics:
+                lines.append(f"# TYPE flight_tracker_{metric} counter")
+                for key, value in sorted(values.items()):
+                    lines.append(f'flight_tracker_{metric}{{{label}="{key}"}} {value}')
+        return "\n".join(lines) + "\n"
@@ -1,4 +1,7 @@
 """This file contains the Request class, which is used to parse the request from the frontend"""
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 class Request:
@@ -26,6 +29,8 @@ class Request:
         self.airlines = self.details["airlines"]
         self.is_cargo = self.details["cargo"]
         self.is_passenger = self.details["passenger"]
+        self.min_distance = self.details["min_distance"]
+        self.max_distance = self.details["max_distance"]
 
         self.adv_req = AdvancedRequest(
             self.details["advanced_start_date"],
@@ -82,7 +87,11 @@ class Request:
         to_return["find_added"] = cookie[23]
         to_return["find_removed"] = cookie[24]
 
-        print("\n\nFrontend Request:\n", to_return)
+        # optional, in kilometers; older frontends leave them out
+        to_return["min_distance"] = cookie[25] if len(cookie) > 25 else ""
+        to_return["max_distance"] = cookie[26] if len(cookie) > 26 else ""
+
+        logger.debug("Frontend Request: %s", to_return)
         return to_return
 
 
@@ -0,0 +1,189 @@
+"""routes module for the distance and great circle path of each airport pair"""
+import json
+
+import numpy as np
+import pandas as pd
+
+AIRPORTS_FILENAME = "./static/airports.json"
+
+EARTH_RADIUS_KM = 6371.0
+
+# Most points in a great circle path, including both airports
+PATH_POINTS = 16
+
+# Length of one path segment; shorter routes get fewer points
+KM_PER_SEGMENT = 500.0
+
+
+def load_airports(filename=AIRPORTS_FILENAME):
+    """
+    Load the airport coordinates
+    Parameters:
+        filename: airports json file written by airport_info.py
+    Returns: pandas dataframe indexed by ICAO code with lat and lng columns
+    """
+    with open(filename, encoding="utf8") as file:
+        airports = json.load(file)
+    return pd.DataFrame.from_dict(airports, orient="index")[["lat", "lng"]]
+
+
+def to_vectors(lat, lng):
+    """
+    Convert coordinates in degrees to unit vectors
+    Parameters:
+        lat: numpy array of latitudes
+        lng: numpy array of longitudes
+    Returns: numpy array of shape (..., 3)
+    """
+    lat = np.radians(lat)
+    lng = np.radians(lng)
+    return np.stack(
+        [np.cos(lat) * np.cos(lng), np.cos(lat) * np.sin(lng), np.sin(lat)], axis=-1
+    )
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """
+    Great circle distance between two arrays of coordinates
+    Parameters:
+        lat1, lng1: numpy arrays with the first coordinates in degrees
+        lat2, lng2: numpy arrays with the second coordinates in degrees
+    Returns: numpy array of distances in kilometers
+    """
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def great_circle_paths(lat1, lng1, lat2, lng2, distance):
+    """
+    Points along the great circle between two arrays of coordinates
+    Parameters:
+        lat1, lng1: numpy arrays with the first coordinates in degrees
+        lat2, lng2: numpy arrays with the second coordinates in degrees
+        distance: numpy array of the haversine distances in kilometers
+    Returns: (paths, points) where paths has shape (pairs, PATH_POINTS, 2) of
+        lat/lng degrees and points is the number of points each path uses
+    """
+    points = np.clip(np.ceil(distance / KM_PER_SEGMENT).astype(int) + 1, 2, PATH_POINTS)
+    # fraction of the way along each route, padded with 1 past its last point
+    fraction = np.minimum(np.arange(PATH_POINTS) / (points[:, None] - 1), 1.0)
+
+    start = to_vectors(lat1, lng1)[:, None, :]
+    end = to_vectors(lat2, lng2)[:, None, :]
+    angle = (distance / EARTH_RADIUS_KM)[:, None, None]
+    sin_angle = np.sin(angle)
+
+    # spherical interpolation, falling back to the start for zero-length routes
+    with np.errstate(divide="ignore", invalid="ignore"):
+        vectors = np.where(
+            sin_angle > 1e-9,
+            (
+                np.sin((1 - fraction[:, :, None]) * angle) * start
+                + np.sin(fraction[:, :, None] * angle) * end
+            )
+            / sin_angle,
+            start,
+        )
+
+    lat = np.degrees(
+        np.arctan2(vectors[..., 2], np.hypot(vectors[..., 0], vectors[..., 1]))
+    )
+    lng = np.degrees(np.arctan2(vectors[..., 1], vectors[..., 0]))
+    return np.stack([lat, lng], axis=-1), points
+
+
+class RouteTable:
+    """
+    RouteTable class
+    Attributes:
+        table: pandas dataframe indexed by (ORIGIN_AIRPORT, DESTINATION_AIRPORT)
+            with the DISTANCE in kilometers and great circle PATH of each pair
+    """
+
+    def __init__(self, pairs, airports):
+        """
+        Parameters:
+            pairs: pandas dataframe with ORIGIN_AIRPORT and DESTINATION_AIRPORT
+            airports: pandas dataframe from load_airports
+        """
+        pairs = pairs[["ORIGIN_AIRPORT", "DESTINATION_AIRPORT"]].drop_duplicates()
+        pairs = pairs[
+            pairs["ORIGIN_AIRPORT"].isin(airports.index)
+            & pairs["DESTINATION_AIRPORT"].isin(airports.index)
+        ]
+
+        origin = airports.loc[pairs["ORIGIN_AIRPORT"]]
+        destination = airports.loc[pairs["DESTINATION_AIRPORT"]]
+        lat1, lng1 = origin["lat"].to_numpy(), origin["lng"].to_numpy()
+        lat2, lng2 = destination["lat"].to_numpy(), destination["lng"].to_numpy()
+
+        distance = haversine(lat1, lng1, lat2, lng2)
+        paths, points = great_circle_paths(lat1, lng1, lat2, lng2, distance)
+        paths = np.round(paths, 3).tolist()
+
+        self.table = pd.DataFrame(
+            {
+                "DISTANCE": np.round(distance, 1),
+                "PATH": [path[:count] for path, count in zip(paths, points)],
+            },
+            index=pd.MultiIndex.from_frame(pairs),
+        )
+        self._lookup = dict(
+            zip(
+                self.table.index,
+                zip(self.table["DISTANCE"].tolist(), self.table["PATH"]),
+            )
+        )
+
+    def distances(self, details):
+        """
+        Distance of each flight
+        Parameters:
+            details: pandas dataframe with ORIGIN_AIRPORT and DESTINATION_AIRPORT
+        Returns: pandas series aligned with details, NaN for unknown airports
+        """
+        index = pd.MultiIndex.from_arrays(
+            [details["ORIGIN_AIRPORT"], details["DESTINATION_AIRPORT"]]
+        )
+        return pd.Series(
+            self.table["DISTANCE"].reindex(index).to_numpy(), index=details.index
+        )
+
+    def attach(self, routes):
+        """
+        Add the distance and path to each route and sort the routes by distance
+        Parameters:
+            routes: list of [origin, destination, airline, is_cargo] lists
+        Returns: list of [origin, destination, airline, is_cargo, distance, path]
+            lists; the path is only sent with the first route of each airport
+            pair, so the other routes of the pair end at distance; routes
+            between unknown airports are left as they are and sorted last
+        """
+        # routes come from a set, so break distance ties by the route itself
+        # to give the same order, and the same route carrying each path, in
+        # every process
+        routes = sorted(
+            routes,
+            key=lambda route: (
+                self._lookup.get((route[0], route[1]), (float("inf"),))[0],
+                [str(value) for value in route[:4]],
+            ),
+        )
+
+        ret_val = []
+        sent = set()
+        for route in routes:
+            pair = (route[0], route[1])
+            geometry = self._lookup.get(pair)
+            if geometry is None:
+                ret_val.append(route)
+            elif pair in sent:
+                ret_val.append(route + [geometry[0]])
+            else:
+                sent.add(pair)
+                ret_val.append(route + [geometry[0], geometry[1]])
+        return ret_val
@@ -1,38 +1,136 @@
 // Filter find routes button functionality
-import { updateMapWithFlights } from "../static/map_script.js";
+import {
+  getMapZoom,
+  onMapZoomChanged,
+  updateMapWithAggregatedRoutes,
+  updateMapWithFlights,
+} from "../static/map_script.js";
+
+let filterData;
+let zoomListener = null;
+let currentJob = null;
+let jobEvents = null;
 
 // Get the data from the filter menu
 export function displayFilteredFlights() {
-  const data = getDataFromFilterMenu();
+  displayFlights(getDataFromFilterMenu());
+}
+
+// Get the data from the filter hotbar
+export function displayQuickFilteredFlights() {
+  displayFlights(getQuickDataFromFilterMenu());
+}
 
-  setCookie("form", data, 5);
+// Cancel the layover search running in the background, if any
+export function cancelBackgroundSearch() {
+  if (currentJob === null) return;
 
   $.ajax({
-    url: "http://127.0.0.1:5000/form",
-    success: function (data) {
-      const flightData = eval(data);
-      updateMapWithFlights(flightData);
+    url: "http://127.0.0.1:5000/jobs/" + currentJob,
+    method: "DELETE",
+  });
+  stopWatchingJob();
+}
+
+function displayFlights(data) {
+  filterData = data;
+  if (zoomListener !== null) {
+    google.maps.event.removeListener(zoomListener);
+    zoomListener = null;
+  }
+  cancelBackgroundSearch();
+
+  setCookie("form", filterData, 5);
+
+  // Layover searches can run for minutes, so they run as background jobs
+  if (parseInt(filterData.split("--")[15]) > 0) {
+    displayFlightsInBackground();
+    return;
+  }
+
+  $.ajax({
+    url: "http://127.0.0.1:5000/lod?zoom=" + getMapZoom(),
+    success: function (lod) {
       // Alert the user if no flights were found
-      if (flightData.length === 0)
+      if (lod["routes"] === 0) {
+        updateMapWithFlights([]);
         alert("No flights were found with the given filters.");
+      } else if (lod["flights"] !== undefined) {
+        // Few enough routes that the server sent them all
+        updateMapWithFlights(lod["flights"]);
+      } else {
+        updateMapWithAggregatedRoutes(lod);
+        zoomListener = onMapZoomChanged(displayAggregatedFlights);
+      }
     },
   });
 }
 
-// Get the data from the filter hotbar
-export function displayQuickFilteredFlights() {
-  const data = getQuickDataFromFilterMenu();
+function displayFlightsInBackground() {
+  $.ajax({
+    url: "http://127.0.0.1:5000/jobs",
+    method: "POST",
+    success: function (job) {
+      watchJob(job["id"]);
+    },
+    error: function (response) {
+      if (response.responseJSON !== undefined)
+        alert(response.responseJSON["error"]);
+      else alert("The search could not be started.");
+    },
+  });
+}
 
-  setCookie("form", data, 5);
+// Show the progress of a background search until it finishes
+function watchJob(jobId) {
+  currentJob = jobId;
+  showJobStatus("Searching for layovers...");
+
+  jobEvents = new EventSource(
+    "http://127.0.0.1:5000/jobs/" + jobId + "/stream"
+  );
+  jobEvents.onmessage = function (event) {
+    const job = JSON.parse(event.data);
+    if (job["status"] === "queued") {
+      showJobStatus("Waiting for other searches to finish...");
+      return;
+    } else if (job["status"] === "running") {
+      showJobStatus(
+        "Searching for layovers: " + job["explored"] + " airports searched"
+      );
+      return;
+    }
 
-  $.ajax({
-    url: "http://127.0.0.1:5000/form",
-    success: function (data) {
-      const flightData = eval(data);
-      updateMapWithFlights(flightData);
-      // Alert the user if no flights were found
-      if (flightData.length === 0)
+    stopWatchingJob();
+    if (job["status"] === "done") {
+      updateMapWithFlights(job["result"]);
+      if (job["result"].length === 0)
         alert("No flights were found with the given filters.");
+    } else if (job["status"] === "failed") {
+      alert("The search stopped: " + job["error"]);
+    }
+  };
+}
+
+function stopWatchingJob() {
+  if (jobEvents !== null) jobEvents.close();
+  jobEvents = null;
+  currentJob = null;
+  document.getElementById("job-status").style.display = "none";
+}
+
+function showJobStatus(text) {
+  document.getElementById("job-status-text").textContent = text;
+  document.getElementById("job-status").style.display = "block";
+}
+
+function displayAggregatedFlights() {
+  setCookie("form", filterData, 5);
+
+  $.ajax({
+    url: "http://127.0.0.1:5000/lod?zoom=" + getMapZoom(),
+    success: function (lod) {
+      updateMapWithAggregatedRoutes(lod);
     },
   });
 }
@@ -201,6 +299,10 @@ function getDataFromFilterMenu() {
   data.push(added);
   data.push(removed);
 
+  // Route Distance, left empty for no bound
+  data.push(document.getElementById("min-distance").value);
+  data.push(document.getElementById("max-distance").value);
+
   return data.join("--");
 }
 
@@ -87,7 +87,8 @@ function createAirportMarker(airportCode) {
 }
 
 // Expects a 2D array of strings containing origin airport, destination airport, airline, and true/false depending on
-// whether or not it is a cargo plane
+// whether or not it is a cargo plane, optionally followed by the distance in kilometers and, for one route per airport pair, the great circle path
+// computed by the server as a list of [lat, lng] points
 export function updateMapWithFlights(flightData) {
   clearMap();
 
@@ -109,25 +110,42 @@ export function updateMapWithFlights(flightData) {
   for (const currentAirportCode of airports.values())
     createAirportMarker(currentAirportCode);
 
+  // The server sends each airport pair's path with only one of its routes
+  const pathsByPair = {};
+  for (let i = 0; i < flightData.length; i++) {
+    const pair = flightData[i][0] + "-" + flightData[i][1];
+    if (flightData[i][5] !== undefined) pathsByPair[pair] = flightData[i][5];
+  }
+
   // Display all the paths
   airlineInfoWindows = [];
   for (let i = 0; i < flightData.length; i++) {
-    const currentPath = [];
+    let currentPath = [];
     const originAirport = flightData[i][0];
     const destinationAirport = flightData[i][1];
-    currentPath.push({
-      lat: airportData[originAirport]["lat"],
-      lng: airportData[originAirport]["lng"],
-    });
-    currentPath.push({
-      lat: airportData[destinationAirport]["lat"],
-      lng: airportData[destinationAirport]["lng"],
-    });
+    const distance = flightData[i][4];
+    const serverPath = pathsByPair[originAirport + "-" + destinationAirport];
+    if (serverPath !== undefined) {
+      currentPath = serverPath.map((point) => ({
+        lat: point[0],
+        lng: point[1],
+      }));
+    } else {
+      currentPath.push({
+        lat: airportData[originAirport]["lat"],
+        lng: airportData[originAirport]["lng"],
+      });
+      currentPath.push({
+        lat: airportData[destinationAirport]["lat"],
+        lng: airportData[destinationAirport]["lng"],
+      });
+    }
 
     const airline = flightData[i][2];
     const flightPath = new google.maps.Polyline({
       path: currentPath,
-      geodesic: true,
+      // The server path already follows the great circle
+      geodesic: serverPath === undefined,
       strokeColor: airlineColors[airline],
       strokeOpacity: 1.0,
       strokeWeight: 5,
@@ -143,6 +161,8 @@ export function updateMapWithFlights(flightData) {
       "Airline: " +
       airlineData[airline] +
       "<br />";
+    if (distance !== undefined)
+      information += "Distance: " + distance + " km<br />";
     if (flightData[i][3] === "true") information += "Cargo airplane";
     else if (flightData[i][3] === "false") information += "Passenger airplane";
 
@@ -165,4 +185,112 @@ export function updateMapWithFlights(flightData) {
   }
 }
 
+export function getMapZoom() {
+  return map.getZoom();
+}
+
+// Calls the callback whenever the map zoom changes, returns the listener so it can be removed
+export function onMapZoomChanged(callback) {
+  return map.addListener("zoom_changed", callback);
+}
+
+function createClusterMarker(cluster) {
+  const location = { lat: cluster["lat"], lng: cluster["lng"] };
+  const names = cluster["airports"].map(
+    (airportCode) => airportData[airportCode]["name"]
+  );
+  const infoWindow = new google.maps.InfoWindow({
+    content:
+      "<strong>" +
+      cluster["airports"].length +
+      " airports</strong><br />" +
+      names.join("<br />"),
+  });
+  const marker = new google.maps.Marker({
+    position: location,
+    map,
+    label: String(cluster["airports"].length),
+    title: cluster["airports"].join(", "),
+  });
+  marker.addListener("click", function () {
+    infoWindow.open(map, marker);
+  });
+
+  airportInfoWindows.push(infoWindow);
+  mapMarkers.push(marker);
+}
+
+// Expects the response of /lod: clusters of airports and the edges between them, each edge weighted by its number of
+// flights and listing the airlines merged into it
+export function updateMapWithAggregatedRoutes(lod) {
+  clearMap();
+
+  // Close any info windows that are currently open
+  for (let i = 0; i < airportInfoWindows.length; i++)
+    airportInfoWindows[i].close();
+  for (let i = 0; i < airlineInfoWindows.length; i++)
+    airlineInfoWindows[i].close();
+
+  // Display all clusters, single airports as usual
+  const clusters = {};
+  for (const cluster of lod["clusters"]) {
+    clusters[cluster["id"]] = cluster;
+    if (cluster["airports"].length === 1)
+      createAirportMarker(cluster["airports"][0]);
+    else createClusterMarker(cluster);
+  }
+
+  // Display all the edges, thicker for busier edges
+  airlineInfoWindows = [];
+  let maxFlights = 1;
+  for (const edge of lod["edges"])
+    maxFlights = Math.max(maxFlights, edge["flights"]);
+
+  for (const edge of lod["edges"]) {
+    const origin = clusters[edge["origin"]];
+    const destination = clusters[edge["destination"]];
+    const airlines = edge["airlines"];
+
+    const flightPath = new google.maps.Polyline({
+      path: [
+        { lat: origin["lat"], lng: origin["lng"] },
+        { lat: destination["lat"], lng: destination["lng"] },
+      ],
+      geodesic: true,
+      strokeColor:
+        airlines.length === 1 ? airlineColors[airlines[0]] : "#555555",
+      strokeOpacity: 0.8,
+      strokeWeight: 1 + 7 * Math.sqrt(edge["flights"] / maxFlights),
+    });
+    flightPath.setMap(map);
+
+    let information =
+      origin["airports"].join(", ") +
+      "&rarr;" +
+      destination["airports"].join(", ") +
+      "<br />" +
+      "Flights: " +
+      edge["flights"] +
+      "<br />" +
+      "Airlines: " +
+      airlines.map((airline) => airlineData[airline]).join(", ") +
+      "<br />";
+    if (edge["cargo"] && edge["passenger"])
+      information += "Cargo and passenger airplanes";
+    else if (edge["cargo"]) information += "Cargo airplanes";
+    else information += "Passenger airplanes";
+
+    const infoWindow = new google.maps.InfoWindow({
+      content: information,
+    });
+    google.maps.event.addListener(flightPath, "click", function (event) {
+      infoWindow.setPosition(event.latLng);
+      infoWindow.open(map);
+    });
+
+    airlineInfoWindows.push(infoWindow);
+    mapPaths.push(flightPath);
+  }
+}
+
 window.initMap = initMap;
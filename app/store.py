@@ -0,0 +1,153 @@
+"""store module for the parquet flight store partitioned by year and month"""
+import datetime
+import sys
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+from flight_info import FlightInfo
+
+PARTITION_COLUMNS = ["YEAR", "MONTH"]
+
+# Rows per parquet row group; each group keeps min/max statistics per column
+ROWS_PER_GROUP = 64 * 1024
+
+LOCATION_COLUMNS = {
+    "origin": {
+        "airport": "ORIGIN_AIRPORT",
+        "country": "ORIGIN_COUNTRY",
+        "continent": "ORIGIN_CONTINENT",
+    },
+    "destination": {
+        "airport": "DESTINATION_AIRPORT",
+        "country": "DESTINATION_COUNTRY",
+        "continent": "DESTINATION_CONTINENT",
+    },
+}
+
+
+def write_store(filename, directory, by_continent=False):
+    """
+    Write a flight csv file as a partitioned parquet store
+    Parameters:
+        filename: csv file with flight details
+        directory: directory to write the store to, replacing matching partitions
+        by_continent: also partition by ORIGIN_CONTINENT
+    """
+    details = FlightInfo(filename).full_data
+
+    # sorted rows give tight min/max statistics for each row group
+    details = details.sort_values("DEPARTURE_TIME")
+
+    partition_columns = PARTITION_COLUMNS.copy()
+    if by_continent:
+        partition_columns.append("ORIGIN_CONTINENT")
+
+    ds.write_dataset(
+        pa.Table.from_pandas(details, preserve_index=False),
+        directory,
+        format="parquet",
+        partitioning=partition_columns,
+        partitioning_flavor="hive",
+        max_rows_per_group=ROWS_PER_GROUP,
+        existing_data_behavior="delete_matching",
+    )
+
+
+def parse_datetime(date, time):
+    """
+    Parse a date and time from the frontend
+    Parameters:
+        date: date as YYYY-MM-DD
+        time: time as HHMM
+    """
+    return datetime.datetime.strptime(
+        date + "-" + time[:2] + "-" + time[2:], "%Y-%m-%d-%H-%M"
+    )
+
+
+class FlightStore:
+    """
+    FlightStore class
+    Attributes:
+        directory: root directory of the store
+        dataset: pyarrow dataset over every partition of the store
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.dataset = ds.dataset(directory, format="parquet", partitioning="hive")
+
+    def load(self, start, end, origin=None, destination=None):
+        """
+        Load the flights departing after start and arriving before end,
+        reading only the partitions and row groups that can match
+        Parameters:
+            start: earliest departure time
+            end: latest arrival time
+            origin: optional (type, values) origin location filter
+            destination: optional (type, values) destination location filter
+        """
+        months = ds.field("YEAR") * 12 + ds.field("MONTH")
+        expression = (
+            (months >= start.year * 12 + start.month)
+            & (months <= end.year * 12 + end.month)
+            & (ds.field("DEPARTURE_TIME") > pa.scalar(start, pa.timestamp("ns")))
+            & (ds.field("ARRIVAL_TIME") < pa.scalar(end, pa.timestamp("ns")))
+        )
+
+        for side, location in (("origin", origin), ("destination", destination)):
+            if location is None or location[0] not in LOCATION_COLUMNS[side]:
+                continue
+            # same "NA" to "UA" rename as FlightInfo.filter_by_location
+            values = ["UA" if value == "NA" else value for value in location[1]]
+            column = LOCATION_COLUMNS[side][location[0]]
+            expression = expression & ds.field(column).isin(values)
+
+        details = self.dataset.to_table(filter=expression).to_pandas()
+
+        # partition columns come back as the narrowest type that fits
+        for column in PARTITION_COLUMNS:
+            details[column] = details[column].astype(int)
+
+        return details
+
+    def airport_pairs(self):
+        """
+        Every distinct origin and destination pair in the store
+        """
+        columns = ["ORIGIN_AIRPORT", "DESTINATION_AIRPORT"]
+        return self.dataset.to_table(columns=columns).to_pandas().drop_duplicates()
+
+    def load_request(self, req):
+        """
+        Load the flights a request can touch
+        Parameters:
+            req: request object from the frontend
+        """
+        start = parse_datetime(req.start_date, req.start_time)
+        end = parse_datetime(req.end_date, req.end_time)
+
+        advanced = "true" in (req.adv_req.filter_added, req.adv_req.filter_removed)
+        if advanced:
+            start = min(
+                start, parse_datetime(req.adv_req.start_date, req.adv_req.start_time)
+            )
+            end = max(end, parse_datetime(req.adv_req.end_date, req.adv_req.end_time))
+
+        # layover searches and added/removed comparisons look past the
+        # requested locations, so only the dates can be pushed down for them
+        if advanced or int(req.num_layovers) > 0:
+            return self.load(start, end)
+
+        return self.load(
+            start,
+            end,
+            (req.origin_type, req.origin_values),
+            (req.dest_type, req.dest_values),
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[3:] not in ([], ["--continent"]):
+        sys.exit("usage: python store.py <flights.csv> <store directory> [--continent]")
+    write_store(sys.argv[1], sys.argv[2], by_continent=len(sys.argv) == 4)